@@ -4,6 +4,22 @@ import React, { useState, useEffect } from 'react';
 import { io } from 'socket.io-client';
 import './App.css';
 
+// Update rates (Hz) requested from the server; it snaps them to its rate buckets
+const VISIBLE_RATE = 2;
+const HIDDEN_RATE = 1;
+
+const currentRate = () => (document.hidden ? HIDDEN_RATE : VISIBLE_RATE);
+
+// Keep the same clientId across reloads of this tab so the server can restore
+// our state (sessionStorage is per tab, so each tab keeps its own state)
+const loadClientId = () => {
+  let id = window.sessionStorage.getItem('clientId');
+  if (!id) {
+    id = Math.random().toString(36).substr(2, 9);
+    window.sessionStorage.setItem('clientId', id);
+  }
+  return id;
+};
 
 
 function App() {
@@ -12,7 +28,7 @@ function App() {
   const [isConnected, setIsConnected] = useState(false);
   const [socket, setSocket] = useState(null);
   const [buttonState, setButtonState] = useState(false);
-  const [clientId] = useState(() => Math.random().toString(36).substr(2, 9));
+  const [clientId] = useState(loadClientId);
   const [datetimeValue, setDatetimeValue] = useState('');
 
   useEffect(() => {
@@ -34,7 +50,9 @@ function App() {
       reconnection: true,
       reconnectionDelay: 1000,
       reconnectionAttempts: 5,
-      timeout: 20000
+      timeout: 20000,
+      // Called on every (re)connect so the rate matches the page visibility
+      auth: (cb) => cb({ rate: currentRate(), clientId: clientId })
     });
 
     newSocket.on('connect', () => {
@@ -51,6 +69,16 @@ function App() {
       console.log('📨 Received message:', data);
       setRandomNumber(data.randomNumber);
       setBooleanValue(data.boolean);
+      // The welcome message carries whatever the server remembered for this client
+      if (data.state) {
+        console.log('♻️ Restoring saved state:', data.state);
+        if (data.state.buttonState !== undefined) {
+          setButtonState(data.state.buttonState);
+        }
+        if (data.state.datetimeValue !== undefined) {
+          setDatetimeValue(data.state.datetimeValue);
+        }
+      }
     });
 
     newSocket.on('connect_error', (error) => {
@@ -66,13 +94,26 @@ function App() {
       console.log('✅ DateTime acknowledged:', data);
     });
 
+    newSocket.on('rate_ack', (data) => {
+      console.log(`⏱️ Update rate set to ${data.rate} Hz`);
+    });
+
+    // Drop to a lower update rate while the page is hidden
+    const handleVisibilityChange = () => {
+      if (newSocket.connected) {
+        newSocket.emit('set_rate', { rate: currentRate() });
+      }
+    };
+    document.addEventListener('visibilitychange', handleVisibilityChange);
+
     setSocket(newSocket);
 
     return () => {
       console.log('🔌 Cleaning up socket connection');
+      document.removeEventListener('visibilitychange', handleVisibilityChange);
       newSocket.close();
     };
-  }, []);
+  }, [clientId]);
 
   const handleButtonToggle = () => {
     const newButtonState = !buttonState;
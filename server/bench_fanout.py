@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark tick lateness for serial vs sharded fan-out
+
+Runs the same fixed-period tick loop as server.background_thread against a
+simulated socket. Each send does what python-socketio does in threading
+mode for a single sid: encode the packet (CPU work that holds the GIL) and
+put it on that client's outgoing queue. No server or clients are needed:
+
+    python3 bench_fanout.py
+    python3 bench_fanout.py --payload 200 --shards 8 --ticks 10
+
+Columns:
+    late      how late the tick loop started each tick (worst case)
+    done      time from tick start until the last send of that tick finished
+    delivered fraction of per-client sends completed within the budget
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+
+from fanout import ShardedBroadcaster
+
+
+class FakeSocket:
+    """Stand-in for socketio.emit: encode per send, queue per client"""
+
+    def __init__(self, sids):
+        self.queues = {sid: queue.Queue() for sid in sids}
+        self.sent = 0
+        self.done = {}
+        self.lock = threading.Lock()
+
+    def _send(self, event, data, sid):
+        packet = '2' + json.dumps([event, data])
+        self.queues[sid].put(packet)
+
+    def _record(self, tick, count):
+        now = time.monotonic()
+        with self.lock:
+            self.sent += count
+            if now > self.done.get(tick, 0.0):
+                self.done[tick] = now
+
+    def emit(self, event, data, to=None, namespace='/'):
+        if to is None:
+            # A broadcast walks every client serially, like socketio.emit
+            for sid in self.queues:
+                self._send(event, data, sid)
+            self._record(data['tick'], len(self.queues))
+        else:
+            self._send(event, data, to)
+            self._record(data['tick'], 1)
+
+
+def start_thread(target, *args):
+    t = threading.Thread(target=target, args=args, daemon=True)
+    t.start()
+    return t
+
+
+def run(clients, ticks, period, payload, shards):
+    """Return (max lateness, max time to last send, delivered fraction)"""
+    sids = [f'sid-{i}' for i in range(clients)]
+    sock = FakeSocket(sids)
+    broadcaster = None
+    if shards:
+        broadcaster = ShardedBroadcaster(sock.emit, start_thread, queue.Queue,
+                                         shards=shards, budget=period * 0.8)
+        broadcaster.start()
+
+    lateness = []
+    started = {}
+    next_tick = time.monotonic()
+    for tick in range(ticks):
+        now = time.monotonic()
+        lateness.append(max(0.0, now - next_tick))
+        started[tick] = now
+        data = {'tick': tick, 'randomNumber': 0.5, 'values': [0.123456789] * payload}
+        if broadcaster:
+            broadcaster.broadcast('message', data, sids)
+        else:
+            sock.emit('message', data)
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    # Let the shard workers finish the last tick before counting
+    time.sleep(period)
+    if broadcaster:
+        broadcaster.stop()
+    done = max(sock.done.get(tick, started[tick]) - started[tick] for tick in started)
+    return max(lateness), done, sock.sent / float(clients * ticks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[100, 1000, 5000, 10000, 20000])
+    parser.add_argument('--ticks', type=int, default=6)
+    parser.add_argument('--period', type=float, default=0.5)
+    parser.add_argument('--payload', type=int, default=50,
+                        help='extra floats in each message, sets the encode cost')
+    parser.add_argument('--shards', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"period={args.period}s payload={args.payload} floats "
+          f"shards={args.shards} ticks={args.ticks}")
+    print(f"{'clients':>8} {'mode':>8} {'late':>10} {'done':>10} {'delivered':>10}")
+    for clients in args.clients:
+        for mode, shards in (('serial', 0), ('sharded', args.shards)):
+            late, done, delivered = run(clients, args.ticks, args.period,
+                                        args.payload, shards)
+            print(f"{clients:>8} {mode:>8} {late * 1000:>8.1f}ms "
+                  f"{done * 1000:>8.1f}ms {delivered * 100:>9.1f}%")
+
+
+if __name__ == '__main__':
+    main()
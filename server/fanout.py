@@ -0,0 +1,126 @@
+"""
+Sharded fan-out for large broadcasts
+
+Splits the connected sids into shards and hands each shard to its own
+worker, so one slow socket or a large client count no longer stalls the
+background emitter loop.
+"""
+import time
+
+
+class ShardedBroadcaster:
+    """Deliver one event to many sids using a fixed pool of shard workers.
+
+    Each sid always hashes to the same shard and every shard worker drains
+    its own FIFO queue, so messages to a given client keep their order.
+    A job that is still being delivered when its deadline passes gives up
+    on the remaining sids of that shard, which bounds how long one tick can
+    keep the workers busy. The next job for the same stream starts with the
+    first sid that was skipped, so under sustained overload the skips rotate
+    across all clients instead of always hitting the same ones. ``on_skip``,
+    if given, is called from the worker with the list of skipped sids.
+
+    The worker and queue factories are passed in so the same engine works
+    with threads, eventlet greenlets or anything else the SocketIO server
+    was started with (see ``socketio.start_background_task`` and
+    ``socketio.server.eio.create_queue``).
+    """
+
+    def __init__(self, emit, start_task, create_queue, shards=4, budget=0.4,
+                 on_skip=None):
+        self.emit = emit
+        self.on_skip = on_skip
+        self.start_task = start_task
+        self.create_queue = create_queue
+        self.shards = max(1, int(shards))
+        self.budget = budget
+        self.queues = []
+        self.started = False
+        self.broadcasts = 0
+        # One counter dict per shard, each written only by its own worker
+        self.shard_stats = [self._new_shard_stats() for _ in range(self.shards)]
+
+    @staticmethod
+    def _new_shard_stats():
+        return {'sent': 0, 'skipped': 0, 'errors': 0, 'last_duration': 0.0}
+
+    @property
+    def stats(self):
+        """Counters summed over all shards"""
+        shard_stats = [dict(s) for s in self.shard_stats]
+        return {
+            'broadcasts': self.broadcasts,
+            'sent': sum(s['sent'] for s in shard_stats),
+            'skipped': sum(s['skipped'] for s in shard_stats),
+            'errors': sum(s['errors'] for s in shard_stats),
+            'max_shard_duration': max(s['last_duration'] for s in shard_stats),
+        }
+
+    def start(self):
+        """Start the shard workers (done lazily on the first broadcast)"""
+        if self.started:
+            return
+        self.started = True
+        for shard in range(self.shards):
+            q = self.create_queue()
+            self.queues.append(q)
+            self.start_task(self._worker, q, self.shard_stats[shard])
+        print(f"Fan-out engine started with {self.shards} shards")
+
+    def stop(self):
+        """Ask every shard worker to exit once its queue is drained"""
+        for q in self.queues:
+            q.put(None)
+        self.queues = []
+        self.started = False
+
+    def shard_for(self, sid):
+        return hash(sid) % self.shards
+
+    def broadcast(self, event, data, sids, namespace='/', budget=None, key=None):
+        """Queue ``event`` for every sid in ``sids`` and return immediately
+
+        ``budget`` overrides the default delivery budget for this call, for
+        streams whose period differs from the one the engine was built for.
+        ``key`` names the stream (default: the event) for skip rotation.
+        """
+        self.start()
+        deadline = time.monotonic() + (self.budget if budget is None else budget)
+        buckets = [[] for _ in range(self.shards)]
+        for sid in sids:
+            buckets[self.shard_for(sid)].append(sid)
+        for q, shard_sids in zip(self.queues, buckets):
+            if shard_sids:
+                q.put((event, data, shard_sids, namespace, deadline, key or event))
+        self.broadcasts += 1
+
+    def _worker(self, q, stats):
+        # Per stream, the sid to start with on the next job
+        cursors = {}
+        while True:
+            job = q.get()
+            if job is None:
+                break
+            event, data, sids, namespace, deadline, key = job
+            started = time.monotonic()
+            start = sids.index(cursors[key]) if cursors.get(key) in sids else 0
+            sids = sids[start:] + sids[:start]
+            for i, sid in enumerate(sids):
+                if time.monotonic() > deadline:
+                    # Out of budget - drop the rest and start with them next time
+                    skipped = sids[i:]
+                    cursors[key] = skipped[0]
+                    stats['skipped'] += len(skipped)
+                    if self.on_skip:
+                        try:
+                            self.on_skip(skipped)
+                        except Exception as e:
+                            print(f"Fan-out skip callback error: {e}")
+                    break
+                try:
+                    self.emit(event, data, to=sid, namespace=namespace)
+                    stats['sent'] += 1
+                except Exception as e:
+                    stats['errors'] += 1
+                    print(f"Fan-out emit error for {sid}: {e}")
+            stats['last_duration'] = time.monotonic() - started
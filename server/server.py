@@ -3,8 +3,8 @@
 Flask-SocketIO WebSocket Server - Python 3.8.10 Compatible
 Recursion-free implementation with proper shutdown handling
 """
-from flask import Flask
-from flask_socketio import SocketIO, emit
+from flask import Flask, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import time
 import random
@@ -12,6 +12,11 @@ import logging
 import sys
 import signal
 import os
+import math
+from fanout import ShardedBroadcaster
+from sessions import SessionTable, mark_baseline, memory_report, tracemalloc_snapshot
+from state_store import ClientStateStore
+import tracemalloc
 
 # Disable excessive logging to prevent recursion
 logging.getLogger('socketio').setLevel(logging.WARNING)
@@ -39,11 +44,59 @@ bool_state = True
 running = False
 clients_connected = 0
 port = os.getenv("REACT_SOCKETIO_SERVER_PORT",5000)
+
+# Connection cap: 0 accepts any number of clients
+max_clients = int(os.getenv("REACT_SOCKETIO_MAX_CLIENTS", 0))
+sessions = SessionTable(max_clients)
+
+# tracemalloc slows every allocation, so only allow turning it on when asked for
+allow_tracemalloc = os.getenv("REACT_SOCKETIO_ALLOW_TRACEMALLOC", "0") == "1"
+
+# Per-connection update rates (Hz). Clients ask for a rate at connect time
+# (auth={'rate': n}) or later with a 'set_rate' event and are snapped to the
+# nearest bucket. The producer counts ticks of BASE_RATE and each bucket takes
+# every BASE_RATE/rate-th one, so each bucket rate must divide every faster
+# bucket rate (the producer only wakes on ticks of the fastest occupied one).
+RATE_BUCKETS = (1, 2, 10, 50)
+DEFAULT_RATE = 2
+BASE_RATE = max(RATE_BUCKETS)
+TICK_PERIOD = 1.0 / BASE_RATE
+rate_buckets = {rate: set() for rate in RATE_BUCKETS}
+frames_queued = {rate: 0 for rate in RATE_BUCKETS}
+
+# Sharded fan-out: 0 keeps the plain serial socketio.emit broadcast
+fanout_shards = int(os.getenv("REACT_SOCKETIO_FANOUT_SHARDS", 0))
+
+def record_skips(sids):
+    """Count frames the fan-out engine dropped for each client"""
+    for sid in sids:
+        session = sessions.get(sid)
+        if session is not None:
+            session.frames_skipped += 1
+
+broadcaster = None
+if fanout_shards > 0:
+    broadcaster = ShardedBroadcaster(socketio.emit,
+                                     socketio.start_background_task,
+                                     socketio.server.eio.create_queue,
+                                     shards=fanout_shards,
+                                     budget=0.8 / DEFAULT_RATE,
+                                     on_skip=record_skips)
+
+# Last button/datetime values per clientId, written behind to SQLite
+state_db = os.getenv("REACT_SOCKETIO_STATE_DB",
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'client_state.db'))
+state_store = ClientStateStore(state_db)
+
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully"""
     global running
     print(f'\n🛑 Received signal {sig}, shutting down gracefully...')
     running = False
+    try:
+        state_store.close()
+    except Exception as e:
+        print(f"Error flushing client state: {e}")
     print('✅ Server shutdown complete')
     sys.exit(0)
 
@@ -51,34 +104,106 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)   # Ctrl-C
 signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
 
+def rate_room(rate):
+    return f'rate_{rate}'
+
+def parse_rate(rate):
+    """Parse a client-supplied rate (Hz), or None if it isn't a usable number
+
+    Infinity ("as fast as possible") is clamped to the fastest bucket.
+    """
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if math.isinf(rate) and rate > 0:
+        return float(max(RATE_BUCKETS))
+    if not math.isfinite(rate) or rate <= 0:
+        return None
+    return rate
+
+def snap_rate(rate):
+    """Map a requested update rate (Hz) onto the nearest rate bucket"""
+    rate = parse_rate(rate)
+    if rate is None:
+        return DEFAULT_RATE
+    return min(RATE_BUCKETS, key=lambda bucket: abs(bucket - rate))
+
+def set_client_rate(session, rate):
+    """Move a session into the bucket (and room) for ``rate``, returns the granted rate"""
+    granted = snap_rate(rate)
+    current = session.rate
+    if current == granted:
+        return granted
+    if current is not None:
+        rate_buckets[current].discard(session.sid)
+        leave_room(rate_room(current), sid=session.sid, namespace='/')
+    rate_buckets[granted].add(session.sid)
+    join_room(rate_room(granted), sid=session.sid, namespace='/')
+    session.rate = granted
+    return granted
+
+def bucket_boolean(rate, count):
+    """Boolean for the frame a bucket receives at base tick ``count``
+
+    It flips on every frame of that bucket, so each rate sees an
+    alternating value rather than a sample of some other bucket's cadence.
+    """
+    return (count // (BASE_RATE // rate)) % 2 == 0
+
 def background_thread():
-    """Emit random numbers and boolean values twice per second"""
+    """Emit random numbers and boolean values to every rate bucket
+
+    A single producer wakes at the rate of the fastest occupied bucket;
+    slower buckets get every n-th frame of the same random number stream.
+    """
     global bool_state, running
-    print("Background thread started - emitting messages twice per second")
+    print(f"Background thread started - rate buckets {RATE_BUCKETS} Hz")
     
     count = 0
+    next_tick = time.monotonic()
     while running:
         try:
-            # Generate random number
-            random_number = random.random()
-            
-            # Create message
-            data = {
-                'randomNumber': random_number,
-                'boolean': bool_state
-            }
+            # Buckets with clients whose period lands on this tick
+            occupied = [rate for rate in RATE_BUCKETS if rate_buckets[rate]]
+            due = [rate for rate in occupied if count % (BASE_RATE // rate) == 0]
             
-            # Emit to all clients
-            socketio.emit('message', data, namespace='/')
+            if due:
+                # Generate random number
+                random_number = random.random()
+                
+                # Emit the same random number to every due bucket
+                for rate in due:
+                    data = {
+                        'randomNumber': random_number,
+                        'boolean': bucket_boolean(rate, count)
+                    }
+                    if broadcaster:
+                        broadcaster.broadcast('message', data, list(rate_buckets[rate]),
+                                              namespace='/', budget=0.8 / rate,
+                                              key=rate_room(rate))
+                    else:
+                        socketio.emit('message', data, to=rate_room(rate), namespace='/')
+                    frames_queued[rate] += len(rate_buckets[rate])
             
-            print(f"Emit #{count}: random={random_number:.6f}, boolean={bool_state}")
+            # Track the default-rate value for welcome messages
+            if count % (BASE_RATE // DEFAULT_RATE) == 0:
+                bool_state = bucket_boolean(DEFAULT_RATE, count)
+                print(f"Tick #{count}: boolean={bool_state}, "
+                      f"buckets={ {rate: len(rate_buckets[rate]) for rate in RATE_BUCKETS} }")
             
-            # Toggle boolean
-            bool_state = not bool_state
-            count += 1
+            # Skip ahead to the next tick of the fastest occupied bucket (idle: slowest)
+            step = BASE_RATE // (max(occupied) if occupied else min(RATE_BUCKETS))
+            ticks = step - count % step
+            count += ticks
             
-            # Sleep for 500ms (2 times per second)
-            time.sleep(0.5)
+            # Sleep until that tick so emit time doesn't stretch the period
+            next_tick += ticks * TICK_PERIOD
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
             
         except Exception as e:
             print(f"Background thread error: {e}")
@@ -90,35 +215,92 @@ def background_thread():
     print("Background thread stopped")
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     global running, clients_connected
+    if not isinstance(auth, dict):
+        auth = {}
+    session = sessions.add(request.sid, None, auth.get('clientId'))
+    if session is None:
+        print(f'Client rejected, connection limit of {max_clients} reached')
+        return False
     clients_connected += 1
-    print(f'Client connected. Total clients: {clients_connected}')
+    rate = set_client_rate(session, auth.get('rate', DEFAULT_RATE))
+    print(f'Client connected at {rate} Hz. Total clients: {clients_connected}')
     
     # Start background thread when first client connects
     if not running:
         running = True
         socketio.start_background_task(target=background_thread)
         print("Started background message emission")
+    state_store.start(socketio.start_background_task, socketio.sleep)
+    mark_baseline(len(sessions))
+    
+    # Restore what this client last sent, if anything
+    state = None
+    if session.client_id:
+        try:
+            state = state_store.get(session.client_id)
+        except Exception as e:
+            print(f"Error restoring client state: {e}")
     
     # Send welcome message
     emit('message', {
         'randomNumber': random.random(),
-        'boolean': bool_state
+        'boolean': bool_state,
+        'state': state
     })
 
 @socketio.on('disconnect')
 def handle_disconnect():
     global clients_connected
+    session = sessions.remove(request.sid)
+    if session is None:
+        return
     clients_connected -= 1
+    if session.rate is not None:
+        rate_buckets[session.rate].discard(request.sid)
     print(f'Client disconnected. Total clients: {clients_connected}')
 
+@socketio.on('set_rate')
+def handle_set_rate(data):
+    """Handle a client changing its update rate"""
+    try:
+        session = sessions.get(request.sid)
+        if session is None:
+            return
+        session.touch()
+        requested = parse_rate(data.get('rate', DEFAULT_RATE))
+        rate = set_client_rate(session, requested)
+        
+        print(f"⏱️  Client {request.sid} rate set to {rate} Hz (requested {requested})")
+        
+        # Send acknowledgment with the bucket actually granted
+        emit('rate_ack', {
+            'received': True,
+            'requested': requested,
+            'rate': rate,
+            'timestamp': time.time()
+        })
+        
+    except Exception as e:
+        print(f"Error handling rate change: {e}")
+
+def remember_client(client_id):
+    """Attach the client-chosen id to the current session and count the event"""
+    session = sessions.get(request.sid)
+    if session is not None:
+        session.client_id = client_id
+        session.touch()
+
 @socketio.on('toggle_button')
 def handle_toggle_button(data):
     """Handle button toggle from client"""
     try:
         button_state = data.get('buttonState', False)
         client_id = data.get('clientId', 'Unknown')
+        remember_client(client_id)
+        if client_id != 'Unknown':
+            state_store.update(client_id, buttonState=button_state)
         
         print(f"📱 Button toggled by client {client_id}: {button_state}")
         
@@ -139,6 +321,9 @@ def handle_datetime_change(data):
         datetime_value = data.get('datetimeValue', '')
         client_id = data.get('clientId', 'Unknown')
         input_type = data.get('inputType', 'datetime')
+        remember_client(client_id)
+        if client_id != 'Unknown':
+            state_store.update(client_id, datetimeValue=datetime_value, inputType=input_type)
         
         print(f"🕒 User changed {input_type} - Client {client_id}: {datetime_value}")
         
@@ -163,15 +348,65 @@ def index():
     <p>Press Ctrl-C to stop the server</p>
     """
 
+def frames_delivered():
+    """Frames actually handed to sockets (with fan-out, skipped and failed sends excluded)"""
+    if broadcaster:
+        return broadcaster.stats['sent']
+    return sum(frames_queued.values())
+
+def fanout_health():
+    """Fan-out counters plus how the skipped frames are spread over clients"""
+    if not broadcaster:
+        return None
+    skips = [session.frames_skipped for session in list(sessions.sessions.values())]
+    return dict(broadcaster.stats,
+                shards=broadcaster.shards,
+                clients_with_skips=sum(1 for count in skips if count),
+                max_client_skips=max(skips, default=0))
+
 @app.route('/health')
 def health():
     return {
         'status': 'running',
         'clients': clients_connected,
         'background_thread': running,
-        'async_mode': socketio.async_mode
+        'async_mode': socketio.async_mode,
+        'rates': {rate: len(rate_buckets[rate]) for rate in RATE_BUCKETS},
+        'frames_queued': frames_queued,
+        'frames_delivered': frames_delivered(),
+        'client_state': dict(state_store.stats, cached=len(state_store.cache)),
+        'fanout': fanout_health()
     }
 
+@app.route('/health/memory')
+def health_memory():
+    """Memory footprint per connection (read-only)
+
+    Includes the top allocation sites when tracemalloc is running.
+    """
+    report = memory_report(sessions, socketio.server)
+    report['max_clients'] = max_clients or None
+    report['snapshot'] = tracemalloc_snapshot()
+    return report
+
+@app.route('/health/memory/tracemalloc', methods=['POST'])
+def health_memory_tracemalloc():
+    """Turn allocation tracing on or off with ?action=start|stop
+
+    Disabled unless REACT_SOCKETIO_ALLOW_TRACEMALLOC=1 is set.
+    """
+    if not allow_tracemalloc:
+        return {'error': 'tracemalloc control is disabled'}, 403
+    
+    action = request.args.get('action')
+    if action == 'start' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif action == 'stop' and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    elif action not in ('start', 'stop'):
+        return {'error': 'action must be start or stop'}, 400
+    return {'tracemalloc': tracemalloc.is_tracing()}
+
 if __name__ == '__main__':
     print("=" * 50)
     print("WebSocket Server - Recursion-Free Version")
@@ -194,5 +429,9 @@ if __name__ == '__main__':
         print(f"❌ Server error: {e}")
     finally:
         running = False
+        try:
+            state_store.close()
+        except Exception as e:
+            print(f"Error flushing client state: {e}")
         print("👋 Server shutdown complete")
         
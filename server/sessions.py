@@ -0,0 +1,206 @@
+"""
+Per-connection session state and memory accounting
+
+App-level state for each socket lives in one small ClientSession object
+(``__slots__``, no per-instance ``__dict__``) keyed by sid, so the cost of a
+connection can be measured and kept down as the client count grows.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Mapping
+
+
+class ClientSession:
+    """App-level state for one connected socket"""
+    __slots__ = ('sid', 'rate', 'client_id', 'connected_at', 'last_seen', 'events',
+                 'frames_skipped')
+
+    def __init__(self, sid, rate, client_id=None):
+        self.sid = sid
+        self.rate = rate
+        self.client_id = client_id
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at
+        self.events = 0
+        self.frames_skipped = 0
+
+    def touch(self):
+        """Record an event received from this client"""
+        self.last_seen = time.time()
+        self.events += 1
+
+    def size(self):
+        """Approximate bytes held by this session (object plus its own fields)"""
+        total = sys.getsizeof(self)
+        for name in ('sid', 'client_id'):
+            value = getattr(self, name)
+            if value is not None:
+                total += sys.getsizeof(value)
+        return total
+
+
+class SessionTable:
+    """ClientSession objects keyed by sid, optionally capped at ``max_sessions``"""
+
+    def __init__(self, max_sessions=0):
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, sid):
+        return sid in self.sessions
+
+    def add(self, sid, rate, client_id=None):
+        """Create and store a session, or return None if the table is full"""
+        session = ClientSession(sid, rate, client_id)
+        with self.lock:
+            if self.max_sessions and len(self.sessions) >= self.max_sessions:
+                return None
+            self.sessions[sid] = session
+        return session
+
+    def get(self, sid):
+        return self.sessions.get(sid)
+
+    def remove(self, sid):
+        with self.lock:
+            return self.sessions.pop(sid, None)
+
+    def footprint(self):
+        """Bytes used by the table and the sessions in it"""
+        sessions = list(self.sessions.values())
+        session_bytes = sum(session.size() for session in sessions)
+        return {
+            'sessions': len(sessions),
+            'table_bytes': sys.getsizeof(self.sessions),
+            'session_bytes': session_bytes,
+            'bytes_per_session': session_bytes / len(sessions) if sessions else 0,
+        }
+
+
+def rss_bytes():
+    """Current resident set size of this process, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize()
+    except (OSError, ValueError, IndexError, ImportError):
+        pass
+    try:
+        # Peak rather than current RSS, but better than nothing (kB on Linux, bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+
+# RSS and client count once the first client is connected and the background
+# tasks it starts are running, so their fixed cost isn't charged per connection
+baseline = {'rss_bytes': None, 'clients': 0}
+
+
+def mark_baseline(clients):
+    """Record the baseline the first time it is called"""
+    if baseline['rss_bytes'] is None:
+        baseline['rss_bytes'] = rss_bytes()
+        baseline['clients'] = clients
+
+
+def _container_size(obj):
+    """getsizeof of a container plus its direct keys/items (one level deep)"""
+    total = sys.getsizeof(obj)
+    if isinstance(obj, Mapping):
+        for key, value in list(obj.items()):
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        total += sum(sys.getsizeof(item) for item in list(obj))
+    return total
+
+
+def _object_size(obj):
+    """getsizeof of an object plus its attribute values (one level deep)"""
+    total = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is not None:
+        total += _container_size(attrs)
+    return total
+
+
+def socketio_footprint(server):
+    """Approximate bytes held by python-socketio/engineio per-connection state
+
+    ``server`` is the underlying ``socketio.Server`` (``socketio.server`` on
+    the Flask-SocketIO object). Attribute names are looked up defensively as
+    they differ between library versions.
+    """
+    eio_sockets = dict(getattr(getattr(server, 'eio', None), 'sockets', None) or {})
+    environ = dict(getattr(server, 'environ', None) or {})
+    rooms = getattr(getattr(server, 'manager', None), 'rooms', None) or {}
+
+    sockets_bytes = sys.getsizeof(eio_sockets) + sum(
+        _object_size(sock) for sock in eio_sockets.values())
+    environ_bytes = sys.getsizeof(environ) + sum(
+        _container_size(env) for env in environ.values())
+    rooms_bytes = sys.getsizeof(rooms)
+    for namespace_rooms in list(rooms.values()):
+        rooms_bytes += sys.getsizeof(namespace_rooms)
+        for members in list(namespace_rooms.values()):
+            rooms_bytes += _container_size(members)
+
+    total = sockets_bytes + environ_bytes + rooms_bytes
+    return {
+        'engineio_sockets': len(eio_sockets),
+        'engineio_sockets_bytes': sockets_bytes,
+        'environ_bytes': environ_bytes,
+        'rooms_bytes': rooms_bytes,
+        'bytes_per_socket': total / len(eio_sockets) if eio_sockets else 0,
+    }
+
+
+def memory_report(table, server=None):
+    """Process and per-connection memory figures for the /health/memory route"""
+    rss = rss_bytes()
+    clients = len(table)
+    per_client = None
+    added = clients - baseline['clients']
+    if rss is not None and baseline['rss_bytes'] is not None and added > 0:
+        per_client = max(0, rss - baseline['rss_bytes']) / added
+    report = {
+        'rss_bytes': rss,
+        'baseline_rss_bytes': baseline['rss_bytes'],
+        'baseline_clients': baseline['clients'],
+        'rss_per_client_bytes': per_client,
+        'clients': clients,
+        'threads': threading.active_count(),
+        'session_table': table.footprint(),
+        'tracemalloc': tracemalloc.is_tracing(),
+    }
+    if server is not None:
+        report['socketio'] = socketio_footprint(server)
+    return report
+
+
+def tracemalloc_snapshot(limit=10):
+    """Top allocation sites since tracing started, grouped by source line"""
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    return {
+        'traced_bytes': current,
+        'peak_bytes': peak,
+        'top': [
+            {'where': str(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:limit]
+        ],
+    }
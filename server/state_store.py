@@ -0,0 +1,200 @@
+"""
+Per-client UI state with write-behind persistence
+
+The last button and datetime values each client sent are kept in memory,
+keyed by the clientId the React client generates, and flushed to a SQLite
+database (WAL mode) in batches by a background task. Socket handlers only
+touch the in-memory dicts, so they never wait on disk.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache marker for ids known to have no stored state
+_MISSING = object()
+
+
+class ClientStateStore:
+    """In-memory client state backed by SQLite, flushed every ``flush_interval`` seconds
+
+    ``cache`` holds complete states for up to ``cache_size`` clients (least
+    recently used evicted first). Updates are queued per field in ``dirty``,
+    and the flusher merges them into the stored row, so an update for a
+    client that isn't cached never drops fields already on disk. A lookup
+    that misses the cache costs one primary-key read on a connection of its
+    own, which WAL lets run alongside the flusher's writes.
+    """
+
+    def __init__(self, path, flush_interval=1.0, cache_size=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.flushing = {}
+        self.flush_generation = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.writer = None
+        self.reader = None
+        self.flusher = None
+        self.running = False
+        self.closed = False
+        self.stats = {'writes': 0, 'flushes': 0, 'flushed_rows': 0, 'db_reads': 0}
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS client_state ('
+                   'client_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)')
+        db.commit()
+        return db
+
+    def _writer(self):
+        if self.writer is None:
+            self.writer = self._open()
+        return self.writer
+
+    def _reader(self):
+        if self.reader is None:
+            self.reader = self._open()
+        return self.reader
+
+    def start(self, start_task, sleep):
+        """Start the write-behind flusher using the server's task and sleep functions"""
+        if self.running or self.closed:
+            return
+        self.running = True
+        with self.write_lock:
+            self._writer()
+        self.flusher = start_task(self._flusher, sleep)
+        print(f"Client state store started: {self.path}")
+
+    def _flusher(self, sleep):
+        while self.running:
+            sleep(self.flush_interval)
+            if not self.running:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Client state flush error: {e}")
+
+    def close(self):
+        """Stop the flusher, write out anything still pending and close the database"""
+        if self.closed:
+            return
+        self.running = False
+        flusher, self.flusher = self.flusher, None
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        # Refuse new writes first so nothing lands after the final flush
+        with self.lock:
+            self.closed = True
+        self._write_pending()
+        with self.write_lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        with self.read_lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+
+    def update(self, client_id, **fields):
+        """Merge ``fields`` into the client's state; persisted on the next flush"""
+        with self.lock:
+            if self.closed:
+                print(f"Client state store closed, ignoring update for {client_id}")
+                return
+            self.dirty[client_id] = dict(self.dirty.get(client_id, {}), **fields)
+            state = self.cache.get(client_id)
+            if state is not None:
+                # Only a complete cached state can be updated in place
+                state = dict({} if state is _MISSING else state, **fields)
+                self.cache[client_id] = state
+                self.cache.move_to_end(client_id)
+            self.stats['writes'] += 1
+
+    def get(self, client_id):
+        """Return a copy of the client's state, or None if nothing was stored"""
+        with self.lock:
+            state = self.cache.get(client_id)
+            if state is not None:
+                self.cache.move_to_end(client_id)
+                return None if state is _MISSING else dict(state)
+
+        # Re-read once if a flush completed meanwhile, as its fields may be
+        # neither in the row we read nor pending any more
+        for attempt in range(2):
+            with self.lock:
+                generation = self.flush_generation
+            with self.read_lock:
+                if self.closed:
+                    # Shutting down - only what is already cached is available
+                    return None
+                row = self._reader().execute('SELECT state FROM client_state WHERE client_id = ?',
+                                             (client_id,)).fetchone()
+            with self.lock:
+                self.stats['db_reads'] += 1
+                if self.flush_generation == generation or attempt:
+                    break
+
+        with self.lock:
+            state = self.cache.get(client_id)
+            if state is None:
+                state = json.loads(row[0]) if row else {}
+                # Fields not flushed yet win over what is on disk
+                state.update(self.flushing.get(client_id, {}))
+                state.update(self.dirty.get(client_id, {}))
+                state = state or _MISSING
+                self.cache[client_id] = state
+                self._evict()
+            return None if state is _MISSING else dict(state)
+
+    def _evict(self):
+        # Pending fields live in dirty/flushing, so any cached entry can go
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def flush(self):
+        """Merge every pending update into its stored row in one transaction"""
+        if self.closed:
+            return 0
+        return self._write_pending()
+
+    def _write_pending(self):
+        with self.lock:
+            if not self.dirty:
+                return 0
+            pending, self.dirty = self.dirty, {}
+            self.flushing = pending
+        now = time.time()
+        try:
+            with self.write_lock:
+                db = self._writer()
+                with db:
+                    for client_id, fields in pending.items():
+                        row = db.execute('SELECT state FROM client_state WHERE client_id = ?',
+                                         (client_id,)).fetchone()
+                        state = json.loads(row[0]) if row else {}
+                        state.update(fields)
+                        db.execute('INSERT OR REPLACE INTO client_state (client_id, state, updated) '
+                                   'VALUES (?, ?, ?)', (client_id, json.dumps(state), now))
+        except Exception:
+            # Put the batch back underneath anything newer that arrived meanwhile
+            with self.lock:
+                for client_id, fields in pending.items():
+                    self.dirty[client_id] = dict(fields, **self.dirty.get(client_id, {}))
+                self.flushing = {}
+            raise
+        with self.lock:
+            self.flushing = {}
+            self.flush_generation += 1
+            self.stats['flushes'] += 1
+            self.stats['flushed_rows'] += len(pending)
+        return len(pending)